@@ -3,12 +3,45 @@ Bluff Royal — Connection Manager
 Gestionnaire de connexions WebSocket pour les parties multijoueurs en temps réel.
 """
 
+import asyncio
+from dataclasses import dataclass
+from typing import Any
 from uuid import UUID
 
+import orjson
 from fastapi import WebSocket
+from pydantic import BaseModel
 
 from models import GameState
 
+# Délai de regroupement des diffusions (secondes) : les changements d'état
+# rapprochés (ex: fin de timer + coup suivant) ne produisent qu'un seul envoi
+BROADCAST_DEBOUNCE = 0.01
+
+# Messages en attente par connexion au-delà desquels le client est jugé trop lent
+# (sa connexion est alors fermée plutôt que d'accumuler les messages en mémoire)
+MAX_PENDING_MESSAGES = 256
+
+
+def pydantic_default(obj: Any) -> Any:
+    """Hook `default` d'orjson pour les modèles Pydantic (UUID et Enum sont gérés nativement)."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Type non sérialisable : {type(obj).__name__}")
+
+
+def encode_message(message: dict) -> str:
+    """Encode un message en texte JSON avec orjson (trame texte pour le client navigateur)."""
+    return orjson.dumps(message, default=pydantic_default).decode()
+
+
+@dataclass(slots=True)
+class _Outbox:
+    """File d'envoi ordonnée d'une connexion et tâche qui la vide."""
+    websocket: WebSocket
+    queue: asyncio.Queue[str]
+    writer: asyncio.Task[None]
+
 
 class ConnectionManager:
     """Gère les connexions WebSocket actives, organisées par partie et par joueur."""
@@ -16,6 +49,16 @@ class ConnectionManager:
     def __init__(self) -> None:
         # game_id -> {player_id -> WebSocket}
         self.active_connections: dict[UUID, dict[UUID, WebSocket]] = {}
+        # (game_id, player_id) -> file d'envoi de la connexion : chaque connexion a
+        # sa propre tâche d'écriture, un client lent ne retarde donc que lui-même
+        self._outboxes: dict[tuple[UUID, UUID], _Outbox] = {}
+        # Fermetures en cours de clients trop lents (références gardées jusqu'à la fin)
+        self._closing: set[asyncio.Task[None]] = set()
+        # game_id -> diffusion différée en attente (et GameState à envoyer)
+        self._pending_broadcasts: dict[UUID, asyncio.Task[None]] = {}
+        self._pending_states: dict[UUID, GameState] = {}
+        # game_id -> (révision, JSON) du dernier GameState diffusé
+        self._payload_cache: dict[UUID, tuple[int, str]] = {}
 
     async def connect(self, websocket: WebSocket, game_id: UUID, player_id: UUID) -> None:
         """Accepte une connexion WebSocket et l'enregistre pour la partie donnée."""
@@ -24,38 +67,117 @@ class ConnectionManager:
             self.active_connections[game_id] = {}
         self.active_connections[game_id][player_id] = websocket
 
+        # Une reconnexion remplace la file d'envoi de l'ancienne connexion
+        self._stop_outbox(game_id, player_id)
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=MAX_PENDING_MESSAGES)
+        writer = asyncio.create_task(self._write_loop(game_id, player_id, websocket, queue))
+        self._outboxes[(game_id, player_id)] = _Outbox(websocket, queue, writer)
+
     def disconnect(self, game_id: UUID, player_id: UUID) -> None:
         """Retire la connexion WebSocket sans supprimer le joueur du GameState (reconnexion possible)."""
+        self._stop_outbox(game_id, player_id)
         if game_id in self.active_connections:
             self.active_connections[game_id].pop(player_id, None)
             # Nettoyage : supprime l'entrée de la partie si plus aucun joueur connecté
             if not self.active_connections[game_id]:
                 del self.active_connections[game_id]
+                self._payload_cache.pop(game_id, None)
 
-    async def broadcast_game_state(self, game_id: UUID, game_state: GameState) -> None:
-        """Sérialise le GameState et l'envoie à tous les joueurs connectés à la partie."""
+    def broadcast_game_state(self, game_id: UUID, game_state: GameState) -> None:
+        """
+        Sérialise le GameState complet et l'envoie à tous les joueurs connectés
+        (message `sync` : connexion d'un joueur, nouvelle donne).
+        """
         if game_id not in self.active_connections:
             return
 
-        # Sérialisation Pydantic V2 → dict JSON-compatible (gère UUID & Enum)
-        payload = game_state.model_dump(mode="json")
+        # Sérialisation Pydantic V2 directe en JSON (cœur Rust, sans dict intermédiaire),
+        # calculée une seule fois pour tous les joueurs et réutilisée tant que
+        # la révision de la partie n'a pas changé
+        cached = self._payload_cache.get(game_id)
+        if cached is not None and cached[0] == game_state.revision:
+            payload = cached[1]
+        else:
+            payload = f'{{"type":"sync","state":{game_state.model_dump_json()}}}'
+            self._payload_cache[game_id] = (game_state.revision, payload)
 
-        for player_id, websocket in self.active_connections[game_id].items():
-            try:
-                await websocket.send_json(payload)
-            except Exception:
-                # La connexion est peut-être déjà fermée ; on l'ignore ici,
-                # la déconnexion sera traitée par la boucle principale.
-                pass
+        self._send_to_all(game_id, payload)
 
-    async def send_personal_message(
-        self, message: dict, game_id: UUID, player_id: UUID
-    ) -> None:
+    def schedule_broadcast(self, game_id: UUID, game_state: GameState) -> None:
+        """Programme la diffusion du GameState ; les demandes rapprochées sont regroupées."""
+        self._pending_states[game_id] = game_state
+        if game_id not in self._pending_broadcasts:
+            self._pending_broadcasts[game_id] = asyncio.create_task(self._flush(game_id))
+
+    async def _flush(self, game_id: UUID) -> None:
+        """Attend la fin du délai de regroupement puis diffuse l'état courant de la partie."""
+        await asyncio.sleep(BROADCAST_DEBOUNCE)
+        # Retiré avant l'envoi : un changement pendant la diffusion en reprogramme une autre
+        self._pending_broadcasts.pop(game_id, None)
+        game_state = self._pending_states.pop(game_id, None)
+        if game_state is not None:
+            self.broadcast_game_state(game_id, game_state)
+
+    def broadcast(self, game_id: UUID, message: dict) -> None:
+        """Envoie un message JSON léger (diff de jeu, présence) à tous les joueurs de la partie."""
+        if game_id not in self.active_connections:
+            return
+        self._send_to_all(game_id, encode_message(message))
+
+    def send_personal_message(self, message: dict, game_id: UUID, player_id: UUID) -> None:
         """Envoie un message JSON privé à un joueur spécifique (ex: erreur, main secrète)."""
-        websocket = self.active_connections.get(game_id, {}).get(player_id)
-        if websocket is None:
+        if (game_id, player_id) not in self._outboxes:
             return
+        self._enqueue(game_id, player_id, encode_message(message))
+
+    # ──────────────────────────────────────────
+    #  Files d'envoi par connexion
+    # ──────────────────────────────────────────
+    # Les méthodes d'envoi ne font que déposer le texte JSON dans la file de chaque
+    # connexion, sans attendre le réseau : elles peuvent être appelées juste après
+    # une modification de l'état, et chaque client reçoit les messages dans l'ordre.
+
+    def _send_to_all(self, game_id: UUID, payload: str) -> None:
+        """Dépose un texte JSON déjà encodé dans la file de chaque connexion de la partie."""
+        for player_id in list(self.active_connections.get(game_id, {})):
+            self._enqueue(game_id, player_id, payload)
+
+    def _enqueue(self, game_id: UUID, player_id: UUID, payload: str) -> None:
+        """Dépose un message dans la file d'une connexion ; ferme les clients trop lents."""
+        outbox = self._outboxes.get((game_id, player_id))
+        if outbox is None:
+            return
+        try:
+            outbox.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.disconnect(game_id, player_id)
+            task = asyncio.create_task(self._close_quietly(outbox.websocket))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _stop_outbox(self, game_id: UUID, player_id: UUID) -> None:
+        """Supprime la file d'envoi d'une connexion et arrête sa tâche d'écriture."""
+        outbox = self._outboxes.pop((game_id, player_id), None)
+        if outbox is not None and outbox.writer is not asyncio.current_task():
+            outbox.writer.cancel()
+
+    async def _write_loop(
+        self, game_id: UUID, player_id: UUID, websocket: WebSocket, queue: asyncio.Queue[str]
+    ) -> None:
+        """Envoie un par un, dans l'ordre, les messages déposés pour une connexion."""
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except Exception:
+            # Connexion fermée : on la retire (sauf si le joueur s'est reconnecté entre-temps)
+            if self.active_connections.get(game_id, {}).get(player_id) is websocket:
+                self.disconnect(game_id, player_id)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket) -> None:
+        """Ferme la connexion d'un client trop lent, en ignorant une connexion déjà fermée."""
         try:
-            await websocket.send_json(message)
+            await websocket.close(code=1013, reason="Client trop lent")
         except Exception:
             pass
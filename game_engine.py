@@ -9,16 +9,29 @@ from __future__ import annotations
 import asyncio
 import logging
 import random
+from collections import Counter, defaultdict
 from typing import TYPE_CHECKING, Callable, Coroutine
 from uuid import UUID
 
-from models import Card, Claim, GamePhase, GameState, Suit
+from models import (
+    DECK_SIZE,
+    Card,
+    Claim,
+    GamePhase,
+    GameState,
+    decode_card,
+    encode_card,
+    serialize_cards,
+)
 
 if TYPE_CHECKING:
     from typing import Any
 
 logger = logging.getLogger("bluff_royal.engine")
 
+# Paquet de 52 cartes encodées (voir models.encode_card), construit une seule fois
+_DECK_TEMPLATE: tuple[int, ...] = tuple(range(DECK_SIZE))
+
 
 class GameEngine:
     """Moteur de jeu Bluff Royal — gère les règles, les timers et les transitions de phase."""
@@ -26,16 +39,35 @@ class GameEngine:
     def __init__(
         self,
         active_games: dict[UUID, GameState],
-        on_state_changed: Callable[[UUID], Coroutine[Any, Any, None]] | None = None,
+        on_state_changed: Callable[[UUID, dict[str, Any]], Coroutine[Any, Any, None]] | None = None,
     ) -> None:
         # Référence partagée vers le stockage des parties en mémoire
         self.active_games = active_games
-        # Timers actifs par partie (asyncio.Task de la fenêtre de réaction)
-        self.active_timers: dict[UUID, asyncio.Task[None]] = {}
-        # Callback optionnel appelé quand le GameState est modifié par le timer
-        # (permet au main.py de déclencher un broadcast)
+        # Timers actifs par partie : tâche de la fenêtre de réaction + événement
+        # d'arrêt (positionné par call_bluff, relu par le timer à son réveil ;
+        # aucune annulation ni exception, quel que soit le chemin)
+        self.active_timers: dict[UUID, tuple[asyncio.Task[None], asyncio.Event]] = {}
+        # Verrou par partie : les actions des joueurs et le timer s'exécutent
+        # un par un, le moteur peut donc supposer un seul écrivain. Les sections
+        # protégées ne contiennent aujourd'hui aucun await, le verrou ne se dispute
+        # donc pas : il garde cette garantie si une étape asynchrone y est ajoutée
+        self._locks: defaultdict[UUID, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Callback optionnel appelé quand le GameState est modifié par le timer,
+        # avec le message de diff correspondant (permet au main.py de le diffuser)
         self._on_state_changed = on_state_changed
 
+    def lock(self, game_id: UUID) -> asyncio.Lock:
+        """Renvoie le verrou de la partie, à tenir pendant toute modification de son état."""
+        return self._locks[game_id]
+
+    def remove_game(self, game_id: UUID) -> None:
+        """Supprime la partie : arrête son timer de réaction et libère son verrou."""
+        self.active_games.pop(game_id, None)
+        timer = self.active_timers.pop(game_id, None)
+        if timer is not None:
+            timer[1].set()
+        self._locks.pop(game_id, None)
+
     # ──────────────────────────────────────────
     #  Helpers internes
     # ──────────────────────────────────────────
@@ -49,27 +81,35 @@ class GameEngine:
 
     def _get_player_index(self, game: GameState, player_id: UUID) -> int:
         """Renvoie l'index du joueur dans la liste, ou lève une erreur."""
-        for idx, p in enumerate(game.players):
-            if p.id == player_id:
-                return idx
-        raise ValueError(f"Joueur introuvable : {player_id}")
+        try:
+            return game.player_index[player_id]
+        except KeyError:
+            raise ValueError(f"Joueur introuvable : {player_id}") from None
 
     def _next_active_player(self, game: GameState, after_index: int) -> UUID | None:
         """Renvoie l'ID du prochain joueur qui n'a pas passé, en bouclant sur la liste."""
         n = len(game.players)
         if n == 0:
             return None
+        mask = game.passed_mask
         for offset in range(1, n + 1):
-            candidate = game.players[(after_index + offset) % n]
-            if not candidate.has_passed:
-                return candidate.id
+            idx = (after_index + offset) % n
+            if not mask >> idx & 1:
+                return game.players[idx].id
         # Tous les joueurs ont passé → fin du pli
         return None
 
     @staticmethod
-    def _build_deck() -> list[Card]:
-        """Construit un jeu de 52 cartes (valeurs 3→15, 4 couleurs) et le mélange."""
-        deck = [Card(value=v, suit=s) for v in range(3, 16) for s in Suit]
+    def _reset_passes(game: GameState) -> None:
+        """Remet à zéro les passes (le masque et le drapeau sérialisé de chaque joueur)."""
+        game.passed_mask = 0
+        for player in game.players:
+            player.has_passed = False
+
+    @staticmethod
+    def _build_deck() -> list[int]:
+        """Copie le jeu de 52 cartes pré-construit et le mélange."""
+        deck = list(_DECK_TEMPLATE)
         random.shuffle(deck)
         return deck
 
@@ -97,7 +137,7 @@ class GameEngine:
         cards_per_player = len(deck) // n
         for i, player in enumerate(game.players):
             player.hand = deck[i * cards_per_player : (i + 1) * cards_per_player]
-            player.has_passed = False
+        self._reset_passes(game)
 
         # Le premier joueur commence
         game.active_player_id = game.players[0].id
@@ -110,6 +150,7 @@ class GameEngine:
             game_id, n, cards_per_player,
         )
 
+        game.revision += 1
         return game
 
     # ──────────────────────────────────────────
@@ -122,10 +163,10 @@ class GameEngine:
         player_id: UUID,
         cards: list[Card],
         claim: Claim,
-    ) -> GameState:
+    ) -> tuple[GameState, dict[str, Any]]:
         """
         Le joueur pose des cartes face cachée et fait une annonce (claim).
-        Retourne le GameState mis à jour.
+        Retourne le GameState mis à jour et le message de diff `play` à diffuser.
         """
         game = self._get_game(game_id)
 
@@ -140,26 +181,33 @@ class GameEngine:
         player = game.players[player_idx]
 
         # Vérifie que le joueur possède bien les cartes qu'il pose
-        hand_copy = list(player.hand)
-        for card in cards:
-            try:
-                hand_copy.remove(card)
-            except ValueError:
-                raise ValueError(
-                    f"Le joueur ne possède pas la carte : {card.value} de {card.suit.value}"
-                )
+        # (soustraction de multi-ensembles : une carte posée deux fois est aussi refusée)
+        card_ids = [encode_card(c) for c in cards]
+        played = Counter(card_ids)
+        missing = played - Counter(player.hand)
+        if missing:
+            card = decode_card(next(iter(missing)))
+            raise ValueError(
+                f"Le joueur ne possède pas la carte : {card.value} de {card.suit.value}"
+            )
 
         # ── Application ──
 
-        # Retire les cartes de la main
-        player.hand = hand_copy
+        # Retire les cartes de la main (chaque carte est unique dans le paquet)
+        player.hand = [cid for cid in player.hand if cid not in played]
 
-        # Mémorise le nombre de cartes posées dans ce coup pour call_bluff
-        self._last_play_count: int = len(cards)
-        self._last_player_id: UUID = player_id
+        # Mémorise le coup sur la partie (et non sur le moteur, partagé entre parties)
+        game.last_play_count = len(cards)
+        game.last_player_id = player_id
+        # Masque des valeurs réellement posées (bit `valeur - 3`) : call_bluff
+        # n'a plus qu'à le comparer au bit de la valeur annoncée
+        values_mask = 0
+        for card_id in card_ids:
+            values_mask |= 1 << (card_id >> 2)
+        game.last_play_values = values_mask
 
         # Ajoute au centre de la table (face cachée)
-        game.current_trick.extend(cards)
+        game.current_trick.extend(card_ids)
 
         # Enregistre l'annonce
         game.current_claim = claim
@@ -168,8 +216,10 @@ class GameEngine:
         game.phase = GamePhase.ReactionWindow
 
         # Lance le timer asynchrone de 3 secondes
-        self.active_timers[game_id] = asyncio.create_task(
-            self._reaction_timer(game_id)
+        stop_event = asyncio.Event()
+        self.active_timers[game_id] = (
+            asyncio.create_task(self._reaction_timer(game_id, stop_event)),
+            stop_event,
         )
 
         logger.info(
@@ -177,13 +227,20 @@ class GameEngine:
             player_id, len(cards), claim.quantity, claim.value,
         )
 
-        return game
+        game.revision += 1
+        update = {
+            "type": "play",
+            "player_id": player_id,
+            "count": len(card_ids),
+            "claim": claim,
+        }
+        return game, update
 
-    def call_bluff(self, game_id: UUID, caller_id: UUID) -> GameState:
+    def call_bluff(self, game_id: UUID, caller_id: UUID) -> tuple[GameState, dict[str, Any]]:
         """
         Un joueur conteste l'annonce (crie au mensonge).
         Compare les cartes réellement posées avec l'annonce.
-        Retourne le GameState mis à jour.
+        Retourne le GameState mis à jour et le message de diff `resolve` à diffuser.
         """
         game = self._get_game(game_id)
 
@@ -191,13 +248,13 @@ class GameEngine:
         if game.phase != GamePhase.ReactionWindow:
             raise ValueError("Le bluff ne peut être contesté que pendant la fenêtre de réaction")
 
-        if caller_id == getattr(self, "_last_player_id", None):
+        if caller_id == game.last_player_id:
             raise ValueError("Un joueur ne peut pas contester son propre coup")
 
-        # Annule le timer en cours
+        # Arrête le timer en cours
         timer = self.active_timers.pop(game_id, None)
         if timer is not None:
-            timer.cancel()
+            timer[1].set()
 
         claim = game.current_claim
         if claim is None:
@@ -205,25 +262,23 @@ class GameEngine:
 
         # ── Résolution du bluff ──
 
-        # Les dernières cartes posées sont les N dernières du current_trick
-        play_count = getattr(self, "_last_play_count", 0)
-        played_cards = game.current_trick[-play_count:] if play_count > 0 else []
+        play_count = game.last_play_count
+        values_mask = game.last_play_values
 
-        # Vérifie si l'annonce correspond aux cartes réellement posées
+        # Vérifie si l'annonce correspond aux cartes réellement posées :
+        # toutes les cartes ont la valeur annoncée ⇔ le masque n'a que ce bit
         is_bluff = (
-            len(played_cards) != claim.quantity
-            or any(c.value != claim.value for c in played_cards)
+            play_count != claim.quantity
+            or values_mask != 1 << (claim.value - 3)
         )
 
-        liar_id: UUID = getattr(self, "_last_player_id", caller_id)
+        liar_id: UUID = game.last_player_id or caller_id
         liar_idx = self._get_player_index(game, liar_id)
         caller_idx = self._get_player_index(game, caller_id)
 
-        trick_cards = list(game.current_trick)
-
         if is_bluff:
             # MENSONGE détecté → le poseur ramasse tout le pli
-            game.players[liar_idx].hand.extend(trick_cards)
+            taker_idx = liar_idx
             # Le contestataire prend la main
             game.active_player_id = caller_id
             logger.info(
@@ -231,22 +286,38 @@ class GameEngine:
             )
         else:
             # VÉRITÉ → le contestataire ramasse tout le pli
-            game.players[caller_idx].hand.extend(trick_cards)
+            taker_idx = caller_idx
             # Le poseur garde la main
             game.active_player_id = liar_id
             logger.info(
                 "Pas de bluff. Joueur %s (contestataire) ramasse le pli.", caller_id
             )
 
+        # Le pli passe directement dans la main du ramasseur (sans copie intermédiaire)
+        taker = game.players[taker_idx]
+        taker.hand.extend(game.current_trick)
+
+        update = {
+            "type": "resolve",
+            "bluff": is_bluff,
+            "taker_id": taker.id,
+            "trick": serialize_cards(game.current_trick),
+            "active_player_id": game.active_player_id,
+        }
+
         # Nettoyage
         game.current_trick.clear()
         game.current_claim = None
         game.phase = GamePhase.InGame
 
-        return game
+        game.revision += 1
+        return game, update
 
-    def pass_turn(self, game_id: UUID, player_id: UUID) -> GameState:
-        """Le joueur passe son tour dans la série en cours."""
+    def pass_turn(self, game_id: UUID, player_id: UUID) -> tuple[GameState, dict[str, Any]]:
+        """
+        Le joueur passe son tour dans la série en cours.
+        Retourne le GameState mis à jour et le message de diff `turn` à diffuser.
+        """
         game = self._get_game(game_id)
 
         if game.phase != GamePhase.InGame:
@@ -256,6 +327,7 @@ class GameEngine:
             raise ValueError("Ce n'est pas le tour de ce joueur")
 
         player_idx = self._get_player_index(game, player_id)
+        game.passed_mask |= 1 << player_idx
         game.players[player_idx].has_passed = True
 
         # Passe au joueur suivant
@@ -266,8 +338,7 @@ class GameEngine:
             game.current_trick.clear()
             game.current_claim = None
             # Réinitialise les passes pour le prochain pli
-            for p in game.players:
-                p.has_passed = False
+            self._reset_passes(game)
             # Le dernier joueur actif garde la main
             game.active_player_id = player_id
             logger.info("Tous les joueurs ont passé — nouveau pli")
@@ -275,45 +346,64 @@ class GameEngine:
             game.active_player_id = next_id
             logger.info("Joueur %s passe, tour → %s", player_id, next_id)
 
-        return game
+        game.revision += 1
+        update = {
+            "type": "turn",
+            "active_player_id": game.active_player_id,
+            "passed_id": player_id,
+            "trick_cleared": next_id is None,
+        }
+        return game, update
 
     # ──────────────────────────────────────────
     #  Timer asynchrone
     # ──────────────────────────────────────────
 
-    async def _reaction_timer(self, game_id: UUID) -> None:
+    async def _reaction_timer(self, game_id: UUID, stop_event: asyncio.Event) -> None:
         """
         Fenêtre de réaction de 3 secondes.
         Si personne ne conteste avant la fin, le coup est validé
         et le tour passe au joueur suivant.
         """
-        try:
-            await asyncio.sleep(3)
-        except asyncio.CancelledError:
-            # Le timer a été annulé (call_bluff), on ne fait rien ici
-            logger.debug("Timer annulé pour la partie %s (bluff contesté)", game_id)
+        await asyncio.sleep(3)
+        if stop_event.is_set():
+            # Le timer a été arrêté (call_bluff), on ne fait rien ici
+            logger.debug("Timer arrêté pour la partie %s (bluff contesté)", game_id)
             return
 
-        # ── Personne n'a réagi : le coup est validé ──
-        game = self.active_games.get(game_id)
-        if game is None:
-            return
+        async with self.lock(game_id):
+            # Un call_bluff a pu passer pendant l'attente du verrou
+            if stop_event.is_set():
+                return
 
-        liar_id = getattr(self, "_last_player_id", None)
-        if liar_id is not None:
-            liar_idx = self._get_player_index(game, liar_id)
-            next_id = self._next_active_player(game, liar_idx)
-            game.active_player_id = next_id
-        else:
-            game.active_player_id = None
+            # ── Personne n'a réagi : le coup est validé ──
+            # (la partie existe : remove_game positionne l'événement d'arrêt)
+            game = self.active_games[game_id]
 
-        game.phase = GamePhase.InGame
+            liar_id = game.last_player_id
+            if liar_id is not None:
+                liar_idx = self._get_player_index(game, liar_id)
+                next_id = self._next_active_player(game, liar_idx)
+                game.active_player_id = next_id
+            else:
+                game.active_player_id = None
+
+            game.phase = GamePhase.InGame
+            game.revision += 1
+
+            # Nettoyage du timer
+            self.active_timers.pop(game_id, None)
 
-        # Nettoyage du timer
-        self.active_timers.pop(game_id, None)
+            logger.info("Timer expiré pour la partie %s — coup validé, tour suivant", game_id)
 
-        logger.info("Timer expiré pour la partie %s — coup validé, tour suivant", game_id)
+            update = {
+                "type": "turn",
+                "active_player_id": game.active_player_id,
+                "passed_id": None,
+                "trick_cleared": False,
+            }
 
-        # Notifie le main.py pour re-broadcaster l'état
+        # Notifie le main.py pour diffuser le changement de tour, une fois le verrou
+        # relâché (le callback ne fait que déposer le message dans les files d'envoi)
         if self._on_state_changed is not None:
-            await self._on_state_changed(game_id)
+            await self._on_state_changed(game_id, update)
@@ -8,11 +8,12 @@ from pathlib import Path
 from uuid import UUID
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from pydantic import TypeAdapter
 
 from connection_manager import ConnectionManager
 from game_engine import GameEngine
-from models import Card, Claim, GameState, Player
+from models import ErrorMessage, GameCreated, GameState, PlayCardsMessage, Player, serialize_cards
 
 BASE_DIR = Path(__file__).resolve().parent
 
@@ -25,23 +26,38 @@ logger = logging.getLogger("bluff_royal")
 
 app = FastAPI(title="Bluff Royal", version="0.1.0")
 
+# Validation du message play_cards en une seule passe (cartes + annonce)
+_PLAY_CARDS_ADAPTER = TypeAdapter(PlayCardsMessage)
+
+# Corps JSON de l'erreur « partie introuvable », sérialisé une seule fois
+_GAME_NOT_FOUND = ErrorMessage(error="Partie introuvable").model_dump_json()
+
 # Gestionnaire de connexions WebSocket
 manager = ConnectionManager()
 
 # Stockage en mémoire des parties actives (MVP — sera remplacé par une BDD / Redis)
 active_games: dict[UUID, GameState] = {}
 
+# Index des mêmes parties par game_id au format texte : les routes recherchent
+# directement la chaîne reçue dans l'URL, sans la convertir en UUID à chaque requête
+_games_by_key: dict[str, GameState] = {}
+
+
+def _register_game(game: GameState) -> None:
+    """Enregistre une partie dans le stockage et dans l'index texte."""
+    active_games[game.game_id] = game
+    _games_by_key[str(game.game_id)] = game
+
+
 # Crée une partie par défaut pour le client de test (même UUID que dans index.html)
 _DEFAULT_GAME_ID = UUID("00000000-0000-4000-8000-000000000001")
 _default_game = GameState(game_id=_DEFAULT_GAME_ID)
-active_games[_DEFAULT_GAME_ID] = _default_game
+_register_game(_default_game)
 
 
-async def _broadcast_callback(game_id: UUID) -> None:
-    """Callback utilisé par le GameEngine pour re-broadcaster l'état après un timer."""
-    game = active_games.get(game_id)
-    if game is not None:
-        await manager.broadcast_game_state(game_id, game)
+async def _broadcast_callback(game_id: UUID, update: dict) -> None:
+    """Callback utilisé par le GameEngine pour diffuser le changement de tour après un timer."""
+    manager.broadcast(game_id, update)
 
 
 # Moteur de jeu
@@ -58,48 +74,62 @@ async def root():
     return FileResponse(BASE_DIR / "index.html")
 
 @app.post("/games", status_code=201)
-async def create_game() -> dict:
+async def create_game() -> GameCreated:
     """Crée une nouvelle partie et renvoie son game_id."""
     game = GameState()
-    active_games[game.game_id] = game
+    _register_game(game)
     logger.info("Partie créée : %s", game.game_id)
-    return {"game_id": str(game.game_id)}
+    return GameCreated(game_id=game.game_id)
 
 
-@app.get("/games/{game_id}")
-async def get_game(game_id: UUID) -> dict:
+@app.get("/games/{game_key}")
+async def get_game(game_key: str) -> Response:
     """Renvoie l'état courant d'une partie (debug / spectateur)."""
-    game = active_games.get(game_id)
+    game = _games_by_key.get(game_key)
     if game is None:
-        return {"error": "Partie introuvable"}
-    return game.model_dump(mode="json")
+        return Response(content=_GAME_NOT_FOUND, media_type="application/json")
+    # JSON produit directement par Pydantic : évite le ré-encodage par FastAPI
+    return Response(content=game.model_dump_json(), media_type="application/json")
+
+
+@app.delete("/games/{game_key}", status_code=204)
+async def delete_game(game_key: str) -> None:
+    """Supprime une partie (son timer et son verrou sont libérés par le moteur)."""
+    game = _games_by_key.pop(game_key, None)
+    if game is not None:
+        engine.remove_game(game.game_id)
+        logger.info("Partie supprimée : %s", game.game_id)
 
 
 # ──────────────────────────────────────────────
 #  WebSocket — Boucle principale
 # ──────────────────────────────────────────────
 
-@app.websocket("/ws/{game_id}/{player_id}")
-async def websocket_endpoint(websocket: WebSocket, game_id: UUID, player_id: UUID) -> None:
+@app.websocket("/ws/{game_key}/{player_id}")
+async def websocket_endpoint(websocket: WebSocket, game_key: str, player_id: UUID) -> None:
     """Point d'entrée WebSocket par joueur et par partie."""
 
     # Vérifie que la partie existe
-    game = active_games.get(game_id)
+    game = _games_by_key.get(game_key)
     if game is None:
         await websocket.close(code=4004, reason="Partie introuvable")
         return
+    # La suite (moteur, connexions) travaille avec l'UUID de la partie
+    game_id: UUID = game.game_id
 
     # Enregistre la connexion
     await manager.connect(websocket, game_id, player_id)
     logger.info("Joueur %s connecté à la partie %s", player_id, game_id)
 
     # Si le joueur n'est pas encore dans la liste, on l'ajoute au GameState
-    if not any(p.id == player_id for p in game.players):
+    if player_id not in game.player_index:
         new_player = Player(id=player_id, pseudo=f"Joueur-{str(player_id)[:6]}")
         game.players.append(new_player)
+        game.player_index[player_id] = len(game.players) - 1
+        game.revision += 1
 
-    # Diffuse l'état mis à jour à tous les joueurs
-    await manager.broadcast_game_state(game_id, game)
+    # Diffuse l'état complet à tous les joueurs (nouveau venu + liste des joueurs)
+    manager.schedule_broadcast(game_id, game)
 
     try:
         while True:
@@ -108,45 +138,68 @@ async def websocket_endpoint(websocket: WebSocket, game_id: UUID, player_id: UUI
             action = data.get("action")
             logger.info("Action reçue de %s : %s", player_id, action)
 
+            # La partie a pu être supprimée entre-temps : on ferme la connexion
+            # (sans recréer de verrou pour une partie qui n'existe plus)
+            if game_id not in active_games:
+                manager.disconnect(game_id, player_id)
+                await websocket.close(code=4004, reason="Partie introuvable")
+                return
+
             # ── Dispatch des actions vers le GameEngine ──
+            resync = False
+            update: dict | None = None
+            private: dict | None = None
             try:
-                match action:
-                    case "start_game":
-                        engine.start_game(game_id)
-
-                    case "play_cards":
-                        cards = [Card(**c) for c in data.get("cards", [])]
-                        claim = Claim(**data.get("claim", {}))
-                        engine.play_cards(game_id, player_id, cards, claim)
-
-                    case "call_bluff":
-                        engine.call_bluff(game_id, caller_id=player_id)
-
-                    case "pass":
-                        engine.pass_turn(game_id, player_id)
-
-                    case _:
-                        await manager.send_personal_message(
-                            {"type": "error", "message": f"Action inconnue : {action}"},
-                            game_id,
-                            player_id,
-                        )
-                        continue
+                # Un seul écrivain à la fois par partie (actions des joueurs et timer).
+                # Le verrou ne couvre que la modification de l'état, jamais le réseau.
+                async with engine.lock(game_id):
+                    match action:
+                        case "start_game":
+                            engine.start_game(game_id)
+                            resync = True
+
+                        case "play_cards":
+                            msg = _PLAY_CARDS_ADAPTER.validate_python(data)
+                            _, update = engine.play_cards(game_id, player_id, msg.cards, msg.claim)
+                            # La nouvelle main n'est envoyée qu'au joueur concerné
+                            player = game.players[game.player_index[player_id]]
+                            private = {"type": "hand", "hand": serialize_cards(player.hand)}
+
+                        case "call_bluff":
+                            _, update = engine.call_bluff(game_id, caller_id=player_id)
+
+                        case "pass":
+                            _, update = engine.pass_turn(game_id, player_id)
+
+                        case _:
+                            private = {"type": "error", "message": f"Action inconnue : {action}"}
 
             except (ValueError, KeyError) as exc:
-                await manager.send_personal_message(
+                manager.send_personal_message(
                     {"type": "error", "message": str(exc)},
                     game_id,
                     player_id,
                 )
                 continue
 
-            # Après chaque action traitée, on broadcast le nouvel état
-            await manager.broadcast_game_state(game_id, game)
+            # Envois hors du verrou : ils ne font que remplir les files d'envoi des
+            # connexions, sans attente depuis la modification, donc dans l'ordre des coups
+            if resync:
+                # Nouvelle donne : état complet
+                manager.schedule_broadcast(game_id, game)
+            if update is not None:
+                manager.broadcast(game_id, update)
+            if private is not None:
+                manager.send_personal_message(private, game_id, player_id)
 
     except WebSocketDisconnect:
-        manager.disconnect(game_id, player_id)
         logger.info("Joueur %s déconnecté de la partie %s", player_id, game_id)
-        # On broadcast pour informer les autres joueurs
-        if game_id in active_games:
-            await manager.broadcast_game_state(game_id, game)
+        # Un ancien socket remplacé par une reconnexion ne doit pas retirer le nouveau
+        if manager.active_connections.get(game_id, {}).get(player_id) is not websocket:
+            return
+        manager.disconnect(game_id, player_id)
+        # Le GameState n'a pas changé : on prévient simplement les autres joueurs
+        manager.broadcast(
+            game_id,
+            {"type": "presence", "player_id": str(player_id), "connected": False},
+        )
@@ -1,13 +1,21 @@
 """
 Bluff Royal — Data Models
-Modèles Pydantic V2 pour le backend du jeu de cartes multijoueur "Bluff Royal".
+Modèles Pydantic V2 (et dataclasses légères) pour le backend du jeu de cartes multijoueur "Bluff Royal".
 Fusion du Président classique avec des mécaniques de bluff.
 """
 
+from dataclasses import dataclass
 from enum import Enum
+from typing import Annotated, Any
 from uuid import UUID, uuid4
 
-from pydantic import BaseModel, Field
+from pydantic import (
+    BaseModel,
+    Field,
+    PlainSerializer,
+    field_serializer,
+)
+from pydantic.dataclasses import dataclass as pydantic_dataclass
 
 
 # ──────────────────────────────────────────────
@@ -40,29 +48,97 @@ class GamePhase(str, Enum):
     RoundEnd = "RoundEnd"
 
 
+# Valeurs JSON des énumérations, calculées une fois (utilisées par les sérialiseurs)
+_PHASE_JSON: dict[GamePhase, str] = {p: p.value for p in GamePhase}
+_ROLE_JSON: dict[PlayerRole, str] = {r: r.value for r in PlayerRole}
+
+
 # ──────────────────────────────────────────────
 #  Modèles de données
 # ──────────────────────────────────────────────
 
-class Card(BaseModel):
+# Card et Claim sont de petits types valeur créés à chaque message : des dataclasses
+# figées à slots suffisent (Pydantic les valide et les sérialise comme des modèles).
+
+@dataclass(frozen=True, slots=True)
+class Card:
     """Représentation d'une carte à jouer."""
-    value: int = Field(..., ge=3, le=15, description="Valeur de la carte (3‑15, où 15 = 2)")
+    value: int  # Valeur de la carte (3‑15, où 15 = 2)
     suit: Suit
 
+    def __post_init__(self) -> None:
+        if not 3 <= self.value <= 15:
+            raise ValueError(f"Valeur de carte invalide : {self.value} (attendu 3‑15)")
 
-class Claim(BaseModel):
+
+@dataclass(frozen=True, slots=True)
+class Claim:
     """Annonce faite par le joueur lorsqu'il pose ses cartes face cachée."""
-    quantity: int = Field(..., gt=0, description="Nombre de cartes annoncées")
-    value: int = Field(..., ge=3, le=15, description="Valeur annoncée (3‑15)")
+    quantity: int  # Nombre de cartes annoncées
+    value: int  # Valeur annoncée (3‑15)
+
+    def __post_init__(self) -> None:
+        if self.quantity <= 0:
+            raise ValueError(f"Quantité annoncée invalide : {self.quantity}")
+        if not 3 <= self.value <= 15:
+            raise ValueError(f"Valeur annoncée invalide : {self.value} (attendu 3‑15)")
+
+
+# ──────────────────────────────────────────────
+#  Encodage compact des cartes
+# ──────────────────────────────────────────────
+# En interne, une carte est un entier 0‑51 : (valeur - 3) * 4 + indice de couleur.
+# La valeur se lit avec `(card_id >> 2) + 3`, la couleur avec `card_id & 3`.
+# Les objets Card ne sont reconstruits qu'aux frontières (messages entrants / JSON sortant).
+
+DECK_SIZE = 52
+
+_SUITS: tuple[Suit, ...] = tuple(Suit)
+_SUIT_INDEX: dict[Suit, int] = {s: i for i, s in enumerate(_SUITS)}
+
+# Représentation JSON pré-calculée de chaque carte
+_CARD_JSON: tuple[dict[str, Any], ...] = tuple(
+    {"value": (i >> 2) + 3, "suit": _SUITS[i & 3].value} for i in range(DECK_SIZE)
+)
+
+
+def encode_card(card: Card) -> int:
+    """Encode une carte en entier 0‑51."""
+    return (card.value - 3) * 4 + _SUIT_INDEX[card.suit]
+
+
+def decode_card(card_id: int) -> Card:
+    """Reconstruit la carte correspondant à un entier 0‑51."""
+    return Card(value=(card_id >> 2) + 3, suit=_SUITS[card_id & 3])
+
 
+def serialize_cards(card_ids: list[int]) -> list[dict[str, Any]]:
+    """Convertit une liste d'entiers en cartes JSON ({value, suit})."""
+    return [_CARD_JSON[cid] for cid in card_ids]
 
-class Player(BaseModel):
+
+# Liste de cartes encodées, sérialisée comme une liste de Card
+CardIds = Annotated[list[int], PlainSerializer(serialize_cards)]
+
+
+# Player est une dataclass Pydantic à slots (validée à la création, sans __dict__
+# par instance) ; GameState reste un BaseModel, racine de la sérialisation.
+
+@pydantic_dataclass(slots=True, kw_only=True)
+class Player:
     """Joueur connecté à une partie."""
     id: UUID = Field(default_factory=uuid4, description="Identifiant unique du joueur")
     pseudo: str = Field(..., min_length=1, description="Pseudo affiché en jeu")
-    hand: list[Card] = Field(default_factory=list, description="Main actuelle du joueur")
+    hand: CardIds = Field(default_factory=list, description="Main actuelle du joueur (cartes encodées)")
     role: PlayerRole = Field(default=PlayerRole.Neutre, description="Rôle du joueur")
-    has_passed: bool = Field(default=False, description="Le joueur a passé son tour dans la série en cours")
+    has_passed: bool = Field(
+        default=False,
+        description="Le joueur a passé son tour dans la série en cours (miroir de GameState.passed_mask)",
+    )
+
+    @field_serializer("role", when_used="json")
+    def _serialize_role(self, role: PlayerRole) -> str:
+        return _ROLE_JSON[role]
 
 
 class GameState(BaseModel):
@@ -70,6 +146,64 @@ class GameState(BaseModel):
     game_id: UUID = Field(default_factory=uuid4, description="Identifiant unique de la partie")
     players: list[Player] = Field(default_factory=list, description="Liste des joueurs")
     active_player_id: UUID | None = Field(default=None, description="ID du joueur dont c'est le tour")
-    current_trick: list[Card] = Field(default_factory=list, description="Cartes posées face cachée au centre")
+    current_trick: CardIds = Field(default_factory=list, description="Cartes posées face cachée au centre (encodées)")
     current_claim: Claim | None = Field(default=None, description="Dernière annonce en cours")
     phase: GamePhase = Field(default=GamePhase.WaitingForPlayers, description="Phase actuelle de la partie")
+    passed_mask: int = Field(
+        default=0,
+        exclude=True,
+        description="Bit i à 1 si le joueur d'index i a passé dans la série en cours (non sérialisé)",
+    )
+    last_player_id: UUID | None = Field(
+        default=None,
+        exclude=True,
+        description="Auteur du dernier coup posé, pour call_bluff et le timer (non sérialisé)",
+    )
+    last_play_count: int = Field(
+        default=0,
+        exclude=True,
+        description="Nombre de cartes posées lors du dernier coup (non sérialisé)",
+    )
+    last_play_values: int = Field(
+        default=0,
+        exclude=True,
+        description="Masque des valeurs posées lors du dernier coup, bit `valeur - 3` (non sérialisé)",
+    )
+    revision: int = Field(
+        default=0,
+        exclude=True,
+        description="Compteur incrémenté à chaque modification de l'état (non sérialisé)",
+    )
+    player_index: dict[UUID, int] = Field(
+        default_factory=dict,
+        exclude=True,
+        description="Index interne player_id → position dans `players` (non sérialisé)",
+    )
+
+    @field_serializer("phase", when_used="json")
+    def _serialize_phase(self, phase: GamePhase) -> str:
+        return _PHASE_JSON[phase]
+
+
+# ──────────────────────────────────────────────
+#  Messages entrants (WebSocket)
+# ──────────────────────────────────────────────
+
+class PlayCardsMessage(BaseModel):
+    """Message `play_cards` envoyé par un joueur : cartes posées + annonce."""
+    cards: list[Card] = Field(..., description="Cartes posées face cachée")
+    claim: Claim = Field(..., description="Annonce associée au coup")
+
+
+# ──────────────────────────────────────────────
+#  Réponses REST
+# ──────────────────────────────────────────────
+
+class GameCreated(BaseModel):
+    """Réponse de `POST /games`."""
+    game_id: UUID = Field(..., description="Identifiant de la partie créée")
+
+
+class ErrorMessage(BaseModel):
+    """Réponse d'erreur des routes REST."""
+    error: str = Field(..., description="Message d'erreur")